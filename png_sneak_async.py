@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# --------------------------------------------------------------------
+# png_sneak_async.py - asyncio entry points for the encoder/decoder
+#
+# By timescape
+# --------------------------------------------------------------------
+"""
+Sneak payloads into / out of PNG images from asyncio code
+
+Usage:
+from png_sneak_async import encode_async, decode_async
+
+await encode_async("cover.png", "output.png", [b"payload bytes"])
+payload = await decode_async("output.png")
+
+Calling the encoder or decoder directly from a coroutine blocks the
+event loop for the whole PNG read / filter / deflate. These entry
+points keep the loop free:
+
+- File reads and writes run in a worker thread (asyncio.to_thread)
+- The CPU heavy encode / decode runs in an executor, which can be
+  given with executor=. The default is the loop's default executor
+  (a thread pool). As the encoder is pure python and holds the GIL,
+  a concurrent.futures.ProcessPoolExecutor gives real parallelism.
+- A semaphore limits how many encodes / decodes run at once. By
+  default all calls on a loop share one limit of DEFAULT_CONCURRENCY,
+  which set_concurrency() changes. A semaphore can also be given with
+  limiter= for a separate limit.
+
+Cancelling a call stops it at its next await. The output file is only
+written once the encode has finished, so a cancelled encode never
+leaves a partial output behind. A job already running in the
+executor can't be interrupted. It runs to completion and its result
+is thrown away, and the cancelled call only returns once it is done,
+so the job keeps counting against the concurrency limit until then.
+
+Errors are raised as SneakError rather than the SystemExit used by
+the command line tools, so they don't shut down the event loop.
+--------------------------------------------------------------------
+"""
+
+import asyncio
+import io
+import os
+import weakref
+from png_sneak_decode import decode
+from png_sneak_encode import encode
+
+# Default number of encodes / decodes allowed to run at once
+DEFAULT_CONCURRENCY = os.cpu_count() or 1
+
+# Global limit for calls that don't bring their own semaphore
+concurrency = DEFAULT_CONCURRENCY
+
+# Global semaphores enforcing that limit, one per event loop
+# (a semaphore can only be used from the loop it was first used in)
+_limiters = weakref.WeakKeyDictionary()
+
+class SneakError(Exception):
+    """
+    An encode or decode failed
+    """
+
+def set_concurrency(limit):
+    """
+    Set how many encodes / decodes may run at once
+    for calls that share the default limiter
+    """
+
+    global concurrency
+    concurrency = limit
+    _limiters.clear()
+
+def default_limiter():
+    """
+    Return the shared semaphore for the running loop,
+    creating it if needed
+    """
+
+    loop = asyncio.get_running_loop()
+    if loop not in _limiters:
+        _limiters[loop] = asyncio.Semaphore(concurrency)
+    return _limiters[loop]
+
+def read_file(filename):
+    """
+    Return the bytes from a file
+    """
+
+    with open(filename, "rb") as f:
+        return f.read()
+
+def write_file(filename, data):
+    """
+    Write the bytes to a file
+    """
+
+    with open(filename, "wb") as f:
+        f.write(data)
+
+def encode_job(cover_bytes, payloads, segment_size, chunk_bits):
+    """
+    Return the output PNG bytes for the cover PNG bytes and payloads.
+    Runs in the executor, so it has to be picklable for process pools.
+    """
+
+    out = io.BytesIO()
+    try:
+        encode(io.BytesIO(cover_bytes), out, payloads, segment_size,
+               chunk_bits
+               )
+    except SystemExit as e:
+        raise SneakError(str(e))
+    return out.getvalue()
+
+def decode_job(png_bytes, segment, byte_range):
+    """
+    Return the payload bytes from the PNG bytes.
+    Runs in the executor, so it has to be picklable for process pools.
+    """
+
+    try:
+        return bytes(decode(io.BytesIO(png_bytes), segment, byte_range))
+    except SystemExit as e:
+        raise SneakError(str(e))
+
+async def run_job(executor, limiter, job, *args):
+    """
+    Run a job in the executor, once the limiter lets us
+    """
+
+    if limiter is None:
+        limiter = default_limiter()
+    loop = asyncio.get_running_loop()
+    async with limiter:
+        fut = loop.run_in_executor(executor, job, *args)
+        try:
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            # The job keeps running in the executor, so hold on to
+            # the permit until it is done, or the limit is broken.
+            # asyncio.wait never cancels fut, even if we are
+            # cancelled again while waiting.
+            while not fut.done():
+                try:
+                    await asyncio.wait([fut])
+                except asyncio.CancelledError:
+                    pass
+            # Its result is thrown away, errors too
+            if not fut.cancelled():
+                fut.exception()
+            raise
+
+async def encode_async(cover, output, payloads, segment_size=0,
+                       chunk_bits=0, executor=None, limiter=None):
+    """
+    Sneak the payloads into the cover PNG file, writing the
+    new PNG to the output file path.
+
+    payloads is a list of payloads as bytes. Unlike on the
+    encoder's command line, strings aren't taken, as a string that
+    happens to name a file would send that file instead. Read payload
+    files or encode payload strings first. segment_size and chunk_bits
+    are as for the encoder's command line.
+    Returns the number of bytes written.
+    """
+
+    for payload in payloads:
+        if not isinstance(payload, (bytes, bytearray, memoryview)):
+            raise TypeError(
+                "payloads must be bytes, not %s" % type(payload).__name__
+                )
+    payloads = [bytearray(payload) for payload in payloads]
+    cover_bytes = await asyncio.to_thread(read_file, cover)
+    out_bytes = await run_job(executor, limiter, encode_job,
+                              cover_bytes, payloads, segment_size,
+                              chunk_bits)
+    await asyncio.to_thread(write_file, output, out_bytes)
+    return len(out_bytes)
+
+async def decode_async(source, output=None, segment=None, byte_range=None,
+                       executor=None, limiter=None):
+    """
+    Return the payload bytes sneaked into the PNG file.
+
+    The payload is also written to the output file path, if given.
+    segment and byte_range are as for the decoder's command line.
+    """
+
+    png_bytes = await asyncio.to_thread(read_file, source)
+    raw_bytes = await run_job(executor, limiter, decode_job,
+                              png_bytes, segment, byte_range)
+    if output is not None:
+        await asyncio.to_thread(write_file, output, raw_bytes)
+    return raw_bytes
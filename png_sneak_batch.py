@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# --------------------------------------------------------------------
+# png_sneak_batch.py - Run a batch of encodes/decodes, reusing
+#                      cached results
+#
+# By timescape
+# --------------------------------------------------------------------
+"""
+Run a batch of encoder / decoder jobs, with a result cache
+
+Usage:
+python3 png_sneak_batch.py [--cache DIR] [--cache-size MB] [--workers N]
+                           jobs_file
+
+The jobs file lists one job per line, written just like the
+arguments to the encoder or decoder, after the word encode or decode:
+
+encode [--segment-size BYTES] [--chunk-bits N] input output payload ...
+decode [--segment N] [--range START:END] input output
+
+Blank lines and lines starting with # are skipped. Quote file names
+with spaces in them, as on a shell command line.
+
+Every result is kept in a cache (see png_sneak_cache.py), keyed by
+hashes of the input bytes and the job settings. When a job's inputs
+and settings haven't changed since it last ran, its output is copied
+straight out of the cache instead of being encoded / decoded again.
+So re-running a batch after a crash or a failed job only does the
+jobs that hadn't finished yet.
+
+Outputs are written to a temporary name and renamed into place, so
+an interrupted run never leaves a half written output behind.
+
+With --workers N, the jobs that aren't cached run in N worker
+processes. Images and payloads are handed to the workers through
+multiprocessing.shared_memory: the parent reads each job's input
+files straight into a shared memory block and sends the worker only
+the block's name and the offsets of each input. The worker writes
+its output into a new shared memory block and sends back its name
+and size, and the parent writes the output file and cache entry
+straight from that block. So no image or payload is pickled or
+copied between processes. (See png_sneak_bench.py for what that
+costs next to the encode itself.) At most 2 jobs per worker are
+handed out at once, so only their inputs are held in memory, and
+jobs are still reported in the order they are listed.
+
+A failed job is reported and the batch carries on with the next one.
+The exit status is 1 if any job failed.
+--------------------------------------------------------------------
+"""
+
+import argparse
+import io
+import multiprocessing
+import os
+import shlex
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from png_sneak_cache import DEFAULT_CACHE_SIZE, cache_get, cache_key, cache_put
+from png_sneak_decode import decode
+from png_sneak_encode import encode, getBytes, read_payloads
+
+# Global to indicate length of dashes '-' to output for print()
+num_dashes = 45
+
+# Default cache directory
+DEFAULT_CACHE_DIR = ".png_sneak_cache"
+
+def job_parser():
+    """
+    Return the parser for a line of the jobs file
+    """
+
+    parser = argparse.ArgumentParser(prog = "job", add_help = False)
+    kinds = parser.add_subparsers(dest = "kind")
+    kinds.required = True
+
+    enc = kinds.add_parser("encode", add_help = False)
+    enc.add_argument("input")
+    enc.add_argument("output")
+    enc.add_argument("payload", nargs = "+")
+    enc.add_argument("--segment-size", type = int, default = 0)
+    enc.add_argument("--chunk-bits", type = int, default = 0)
+
+    dec = kinds.add_parser("decode", add_help = False)
+    dec.add_argument("input")
+    dec.add_argument("output")
+    dec.add_argument("--segment", type = int)
+    dec.add_argument("--range")
+    return parser
+
+def read_jobs(filename):
+    """
+    Return the list of (line number, parsed job) from the jobs file
+    """
+
+    parser = job_parser()
+    jobs = []
+    text = getBytes(filename).decode("utf8")
+    for n, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            jobs.append((n, parser.parse_args(shlex.split(line))))
+        # argparse exits on a bad line, so catch that instead
+        except (SystemExit, ValueError):
+            raise SystemExit(
+                "ERROR in Jobs File: %s line %d\n%s" % (filename, n, line)
+                )
+    return jobs
+
+def write_output(filename, data):
+    """
+    Write the bytes to a file, by way of a temporary file
+    """
+
+    tmp_name = "%s.%d.tmp" % (filename, os.getpid())
+    try:
+        with open(tmp_name, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, filename)
+    # Exit with Error info it if didn't work
+    except Exception as e:
+        raise SystemExit(
+            "ERROR writing Output File: %s\n%s" % (filename, e)
+            )
+
+def job_key(job, in_bytes, payloads):
+    """
+    Return the cache key for a job
+    """
+
+    if job.kind == "encode":
+        return cache_key("encode", [in_bytes] + list(payloads),
+                         [job.segment_size, job.chunk_bits])
+    return cache_key("decode", [in_bytes], [job.segment, job.range])
+
+def run_job(job, in_bytes, payloads, verbose=False):
+    """
+    Return the output bytes of a job, given its input bytes
+    """
+
+    if job.kind == "encode":
+        out = io.BytesIO()
+        encode(io.BytesIO(in_bytes), out, payloads,
+               job.segment_size, job.chunk_bits, verbose
+               )
+        return out.getvalue()
+    return bytes(decode(io.BytesIO(in_bytes), job.segment, job.range,
+                        verbose
+                        ))
+
+def load_inputs(job):
+    """
+    Return a new shared memory block holding the job's input
+    file and payloads, and the (offset, size) span of each
+    """
+
+    payloads = []
+    if job.kind == "encode":
+        payloads = read_payloads(job.payload)
+    try:
+        in_size = os.path.getsize(job.input)
+    except OSError as e:
+        raise SystemExit(
+            "ERROR reading File: %s\n%s" % (job.input, e)
+            )
+    sizes = [in_size] + [len(p) for p in payloads]
+
+    # Shared memory blocks can't be empty
+    try:
+        shm = SharedMemory(create=True, size=max(sum(sizes), 1))
+    # /dev/shm can fill up like any disk
+    except OSError as e:
+        raise SystemExit(
+            "ERROR allocating shared memory for: %s\n%s" % (job.input, e)
+            )
+    try:
+        # Read the input file straight into the block
+        with open(job.input, "rb") as f, shm.buf[:in_size] as view:
+            if f.readinto(view) != in_size:
+                raise SystemExit(
+                    "ERROR reading File: %s\nFile changed size" % job.input
+                    )
+        spans = [(0, in_size)]
+        offset = in_size
+        for p in payloads:
+            shm.buf[offset:offset + len(p)] = p
+            spans.append((offset, len(p)))
+            offset += len(p)
+    except OSError as e:
+        free_shm(shm)
+        raise SystemExit(
+            "ERROR reading File: %s\n%s" % (job.input, e)
+            )
+    except BaseException:
+        free_shm(shm)
+        raise
+    return shm, spans
+
+def shm_job(job, shm_name, spans, verbose=False):
+    """
+    Run a job on inputs held in a shared memory block.
+
+    Runs in a worker process. Returns (error, name, size, seconds):
+    the error message if the job failed, otherwise the name and size
+    of a new shared memory block holding the output, and the seconds
+    spent on the job itself. The caller unlinks the output block.
+    """
+
+    shm = SharedMemory(name=shm_name)
+    try:
+        views = [shm.buf[start:start + size] for start, size in spans]
+        start = time.perf_counter()
+        try:
+            # The payloads are small, and the encoder wants
+            # them as bytes, so they are copied here
+            payloads = [bytearray(v) for v in views[1:]]
+            out_bytes = run_job(job, views[0], payloads, verbose)
+        # SystemExit isn't an Exception, so multiprocessing
+        # wouldn't hand it back to us
+        except SystemExit as e:
+            return str(e), None, 0, 0.0
+        except Exception as e:
+            return "ERROR: %s" % e, None, 0, 0.0
+        finally:
+            for view in views:
+                view.release()
+        seconds = time.perf_counter() - start
+
+        out_shm = SharedMemory(create=True, size=max(len(out_bytes), 1))
+        out_shm.buf[:len(out_bytes)] = out_bytes
+        out_shm.close()
+        return None, out_shm.name, len(out_bytes), seconds
+    finally:
+        shm.close()
+
+def free_shm(shm):
+    """
+    Close and remove a shared memory block
+    """
+
+    shm.close()
+    shm.unlink()
+
+def report(counts, n, total, line, job, status, error=None):
+    """
+    Count and print the outcome of a job
+    """
+
+    if error is not None:
+        print("line %d: %s" % (line, error))
+    counts[status] += 1
+    print("[%d/%d] %-6s %s %s" % (n, total, status, job.kind, job.output))
+
+def run_here(jobs, args, cache_size, counts):
+    """
+    Run the jobs one at a time in this process
+    """
+
+    for n, (line, job) in enumerate(jobs, 1):
+        error = None
+        try:
+            # Hash the inputs to find the job in the cache
+            in_bytes = getBytes(job.input)
+            payloads = []
+            if job.kind == "encode":
+                payloads = [bytes(p) for p in read_payloads(job.payload)]
+            key = job_key(job, in_bytes, payloads)
+
+            out_bytes = cache_get(args.cache, key)
+            if out_bytes is not None:
+                status = "cached"
+            else:
+                # Not cached, do the work
+                out_bytes = run_job(job, in_bytes, payloads, args.verbose)
+                cache_put(args.cache, key, out_bytes, cache_size)
+                status = "done"
+            write_output(job.output, out_bytes)
+        except SystemExit as e:
+            status = "failed"
+            error = str(e)
+        except Exception as e:
+            status = "failed"
+            error = "ERROR: %s" % e
+        report(counts, n, len(jobs), line, job, status, error)
+
+def job_inputs(job):
+    """
+    Return the paths of the files a job reads
+    """
+
+    paths = [job.input]
+    # Any payload could name a file, including one an earlier
+    # job hasn't written yet
+    if job.kind == "encode":
+        paths += job.payload
+    return [os.path.abspath(p) for p in paths]
+
+def finish_job(entry, args, cache_size, counts, total):
+    """
+    Collect the result of one job handed to the workers
+    """
+
+    n, line, job, key, shm, result = entry
+    # Jobs that were cached or failed early just need their output
+    # written and reporting, result holds their (status, error,
+    # output bytes)
+    if shm is None:
+        status, error, out_bytes = result
+        if out_bytes is not None:
+            try:
+                write_output(job.output, out_bytes)
+            except SystemExit as e:
+                status = "failed"
+                error = str(e)
+        report(counts, n, total, line, job, status, error)
+        return
+
+    try:
+        error, name, size, _ = result.get()
+    except Exception as e:
+        error = "ERROR: %s" % e
+    finally:
+        free_shm(shm)
+    if error is not None:
+        report(counts, n, total, line, job, "failed", error)
+        return
+
+    # Write the output and cache entry straight
+    # out of the worker's shared memory block
+    out_shm = None
+    try:
+        out_shm = SharedMemory(name=name)
+        with out_shm.buf[:size] as view:
+            cache_put(args.cache, key, view, cache_size)
+            write_output(job.output, view)
+        status = "done"
+    except SystemExit as e:
+        status = "failed"
+        error = str(e)
+    except Exception as e:
+        status = "failed"
+        error = "ERROR: %s" % e
+    finally:
+        if out_shm is not None:
+            free_shm(out_shm)
+    report(counts, n, total, line, job, status, error)
+
+def finish_jobs(pending, args, cache_size, counts, total, keep=0):
+    """
+    Collect the results of the jobs handed to the workers, oldest
+    first, until no more than keep of them are left running
+    (keep=0 collects them all)
+    """
+
+    while pending:
+        running = sum(1 for entry in pending if entry[4] is not None)
+        # Jobs that are done already are reported once they reach
+        # the front, without waiting
+        if keep and running <= keep and pending[0][4] is not None:
+            break
+        finish_job(pending.pop(0), args, cache_size, counts, total)
+
+def run_workers(jobs, args, cache_size, counts):
+    """
+    Run the jobs that aren't cached in a pool of worker
+    processes, passing their data through shared memory
+    """
+
+    # Start the resource tracker before the workers, so they all
+    # share it. Shared memory is made in one process and unlinked
+    # in another, and separate trackers would each think it leaked.
+    resource_tracker.ensure_running()
+
+    pool = multiprocessing.Pool(args.workers)
+    try:
+        # Hand out every job that isn't cached. Jobs are reported in
+        # order, so pending also holds finished jobs waiting on an
+        # earlier one.
+        pending = []
+        # Each running job holds its inputs in shared memory, so only
+        # a couple per worker are handed out ahead of time
+        max_running = 2 * args.workers
+        for n, (line, job) in enumerate(jobs, 1):
+            # A job reading the output of a job still running
+            # has to wait for it (and everything before it)
+            outputs = [os.path.abspath(p[2].output) for p in pending]
+            if set(job_inputs(job)) & set(outputs):
+                finish_jobs(pending, args, cache_size, counts, len(jobs))
+            # Make room for this one
+            finish_jobs(pending, args, cache_size, counts, len(jobs),
+                        max_running - 1
+                        )
+
+            shm = None
+            try:
+                shm, spans = load_inputs(job)
+
+                # Hash the inputs to find the job in the cache
+                views = [shm.buf[start:start + size]
+                         for start, size in spans]
+                try:
+                    key = job_key(job, views[0], views[1:])
+                finally:
+                    for view in views:
+                        view.release()
+
+                out_bytes = cache_get(args.cache, key)
+                if out_bytes is None:
+                    result = pool.apply_async(
+                        shm_job, (job, shm.name, spans, args.verbose)
+                        )
+                    pending.append((n, line, job, key, shm, result))
+                    continue
+                free_shm(shm)
+                status, error = "cached", None
+            except SystemExit as e:
+                if shm is not None:
+                    free_shm(shm)
+                status, error, out_bytes = "failed", str(e), None
+            except Exception as e:
+                if shm is not None:
+                    free_shm(shm)
+                status, error = "failed", "ERROR: %s" % e
+                out_bytes = None
+            # Write its output and report it once the jobs before it
+            # are, just as running them one by one would
+            pending.append(
+                (n, line, job, None, None, (status, error, out_bytes))
+                )
+            finish_jobs(pending, args, cache_size, counts, len(jobs),
+                        max_running
+                        )
+
+        # Then collect the rest of the results
+        finish_jobs(pending, args, cache_size, counts, len(jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+def main():
+    """
+    Run every job in the jobs file, skipping the ones whose
+    results are already cached
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("jobs", help = "jobs file path")
+    parser.add_argument("--cache",
+                        default = DEFAULT_CACHE_DIR,
+                        help = "cache directory path"
+                        )
+    parser.add_argument("--cache-size",
+                        type = int,
+                        default = DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help = "cache size limit in megabytes"
+                        )
+    parser.add_argument("--workers",
+                        type = int,
+                        default = 0,
+                        help = "number of worker processes "
+                        + "(0 runs the jobs in this process)"
+                        )
+    parser.add_argument("--verbose",
+                        action = "store_true",
+                        help = "show the encoder / decoder output"
+                        )
+    args = parser.parse_args()
+    cache_size = args.cache_size * 1024 * 1024
+
+    jobs = read_jobs(args.jobs)
+    print("%s" % "-" * num_dashes)
+    print("Jobs: %d" % len(jobs))
+    print("Cache: %s" % args.cache)
+    print("%s" % "-" * num_dashes)
+
+    counts = {"done": 0, "cached": 0, "failed": 0}
+    if args.workers > 0:
+        run_workers(jobs, args, cache_size, counts)
+    else:
+        run_here(jobs, args, cache_size, counts)
+
+    # Print results summary
+    print("%s" % "-" * num_dashes)
+    print("Done: %d  Cached: %d  Failed: %d"
+        % (counts["done"], counts["cached"], counts["failed"])
+        )
+    print("%s" % "-" * num_dashes)
+    if counts["failed"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
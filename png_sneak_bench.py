@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# --------------------------------------------------------------------
+# png_sneak_bench.py - Measure what handing batch jobs to worker
+#                      processes costs, next to the encode itself
+#
+# By timescape
+# --------------------------------------------------------------------
+"""
+Benchmark the shared memory handoff used by png_sneak_batch.py
+
+Usage:
+python3 png_sneak_bench.py [--width W] [--height H] [--payload BYTES]
+                           [--runs N]
+
+A random cover image and payload of the given sizes are made in a
+temporary directory. Then, taking the best of N runs of each:
+
+- encode:  the encode itself, in this process
+- shm:     the same encode run in a worker process the way the batch
+           runner does it, with the inputs and output passed through
+           shared memory
+- pickle:  the same encode run in a worker process with the inputs
+           and output pickled across, for comparison
+
+For the two worker runs, the overhead is the wall clock time of the
+whole round trip minus the time the worker spent on the encode.
+--------------------------------------------------------------------
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+# Use png From package purepng
+import png
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from png_sneak_batch import free_shm, job_parser, load_inputs, run_job, shm_job
+
+# Global to indicate length of dashes '-' to output for print()
+num_dashes = 45
+
+def make_cover(filename, width, height):
+    """
+    Write a random RGB PNG of the given size
+    """
+
+    rows = [os.urandom(width * 3) for _ in range(height)]
+    with open(filename, "wb") as f:
+        png.Writer(width, height, greyscale=False).write(f, rows)
+
+def pickle_job(job, in_bytes, payloads):
+    """
+    Run a job on pickled inputs, returning the output bytes
+    and the seconds spent on the job itself
+    """
+
+    start = time.perf_counter()
+    out_bytes = run_job(job, in_bytes, payloads)
+    return out_bytes, time.perf_counter() - start
+
+def shm_round_trip(pool, job):
+    """
+    Run a job in the pool through shared memory, as the batch
+    runner does. Return (wall seconds, worker seconds).
+    """
+
+    start = time.perf_counter()
+    shm, spans = load_inputs(job)
+    try:
+        error, name, size, seconds = pool.apply(
+            shm_job, (job, shm.name, spans)
+            )
+    finally:
+        free_shm(shm)
+    if error is not None:
+        raise SystemExit(error)
+    out_shm = SharedMemory(name=name)
+    try:
+        with out_shm.buf[:size] as view, open(job.output, "wb") as f:
+            f.write(view)
+    finally:
+        free_shm(out_shm)
+    return time.perf_counter() - start, seconds
+
+def pickle_round_trip(pool, job):
+    """
+    Run a job in the pool with its data pickled across.
+    Return (wall seconds, worker seconds).
+    """
+
+    start = time.perf_counter()
+    with open(job.input, "rb") as f:
+        in_bytes = f.read()
+    with open(job.payload[0], "rb") as f:
+        payloads = [bytearray(f.read())]
+    out_bytes, seconds = pool.apply(pickle_job, (job, in_bytes, payloads))
+    with open(job.output, "wb") as f:
+        f.write(out_bytes)
+    return time.perf_counter() - start, seconds
+
+def main():
+    """
+    Time an encode in process, through shared memory and pickled
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type = int, default = 512,
+                        help = "cover image width"
+                        )
+    parser.add_argument("--height", type = int, default = 512,
+                        help = "cover image height"
+                        )
+    parser.add_argument("--payload", type = int, default = 32,
+                        help = "payload size in bytes"
+                        )
+    parser.add_argument("--runs", type = int, default = 3,
+                        help = "number of runs of each (best is kept)"
+                        )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cover = os.path.join(tmp, "cover.png")
+        payload = os.path.join(tmp, "payload.bin")
+        output = os.path.join(tmp, "output.png")
+        make_cover(cover, args.width, args.height)
+        with open(payload, "wb") as f:
+            f.write(os.urandom(args.payload))
+        job = job_parser().parse_args(["encode", cover, output, payload])
+
+        print("%s" % "-" * num_dashes)
+        print("Cover:   %dx%d, %d bytes"
+            % (args.width, args.height, os.path.getsize(cover))
+            )
+        print("Payload: %d bytes" % args.payload)
+        print("%s" % "-" * num_dashes)
+
+        # The encode itself
+        with open(cover, "rb") as f:
+            in_bytes = f.read()
+        with open(payload, "rb") as f:
+            payloads = [bytearray(f.read())]
+        encode_time = min(pickle_job(job, in_bytes, payloads)[1]
+                          for _ in range(args.runs))
+
+        # Worker round trips
+        resource_tracker.ensure_running()
+        with multiprocessing.Pool(1) as pool:
+            # Warm up the worker
+            pool.apply(time.perf_counter)
+            shm_times = [shm_round_trip(pool, job) for _ in range(args.runs)]
+            pickle_times = [pickle_round_trip(pool, job)
+                            for _ in range(args.runs)]
+
+    shm_overhead = min(wall - work for wall, work in shm_times)
+    pickle_overhead = min(wall - work for wall, work in pickle_times)
+    print("encode:           %8.4f s" % encode_time)
+    print("shm overhead:     %8.4f s  (%.2f%% of encode)"
+        % (shm_overhead, 100 * shm_overhead / encode_time)
+        )
+    print("pickle overhead:  %8.4f s  (%.2f%% of encode)"
+        % (pickle_overhead, 100 * pickle_overhead / encode_time)
+        )
+    print("%s" % "-" * num_dashes)
+
+if __name__ == "__main__":
+    main()
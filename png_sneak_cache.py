@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# --------------------------------------------------------------------
+# png_sneak_cache.py - Content-addressed cache of encoder/decoder
+#                      results
+#
+# By timescape
+# --------------------------------------------------------------------
+"""
+Cache the results of encodes and decodes on disk
+
+An encode is fully decided by the cover PNG bytes, the payload bytes
+and the encoder settings, and a decode by the PNG bytes and the
+decoder settings. The results are stored in a cache directory under
+a key made from sha256 hashes of all of those, so running the same
+job again just copies the result out of the cache.
+
+Each result is one file in the cache directory, named by its key.
+Files are written to a temporary name and then renamed into place,
+so an interrupted run never leaves a half written result behind.
+
+The cache is bounded in size. Reading a result updates its modified
+time, and when the cache grows past its size limit the results used
+least recently are deleted first, down to TRIM_TO of the limit. The
+cache directory is only scanned the first time it is written to and
+when it needs trimming. In between, its size is kept track of here.
+
+Bump CACHE_VERSION when a change to the encoder or decoder changes
+their output, so stale results are no longer found.
+--------------------------------------------------------------------
+"""
+
+import hashlib
+import os
+
+# Mixed into every key, so older results are ignored
+CACHE_VERSION = 1
+
+# Default size limit of the cache directory, in bytes
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# A full cache is trimmed down to this fraction of its size limit,
+# so it isn't scanned again on every write
+TRIM_TO = 0.9
+
+# Size in bytes of each cache directory written to so far
+cache_sizes = {}
+
+def cache_key(kind, data, settings):
+    """
+    Return the cache key for a job.
+
+    kind names the job ("encode" or "decode"), data is a list of the
+    input bytes and settings a list of the other values that change
+    the result.
+    """
+
+    h = hashlib.sha256()
+    h.update(("%s v%d\n" % (kind, CACHE_VERSION)).encode())
+    # Hash each input on its own, so the boundaries between
+    # them are part of the key
+    for item in data:
+        h.update(hashlib.sha256(item).digest())
+    h.update(repr(list(settings)).encode())
+    return h.hexdigest()
+
+def cache_get(cache_dir, key):
+    """
+    Return the cached result for the key, or None if there isn't one
+    """
+
+    path = os.path.join(cache_dir, key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # Mark it as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return data
+
+def cache_put(cache_dir, key, data, max_size=DEFAULT_CACHE_SIZE):
+    """
+    Store the result for the key, then trim the cache to max_size
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    if cache_dir not in cache_sizes:
+        cache_sizes[cache_dir] = cache_size(cache_dir)
+
+    path = os.path.join(cache_dir, key)
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    # Replacing a result frees the space of the old one
+    try:
+        cache_sizes[cache_dir] -= os.path.getsize(path)
+    except OSError:
+        pass
+    os.replace(tmp_path, path)
+    cache_sizes[cache_dir] += len(data)
+
+    if cache_sizes[cache_dir] > max_size:
+        cache_trim(cache_dir, max_size)
+
+def cache_entries(cache_dir):
+    """
+    Return (modified time, size, path) for each result in the cache
+    """
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        # Skip anything that isn't a finished result
+        if not entry.is_file() or entry.name.endswith(".tmp"):
+            continue
+        st = entry.stat()
+        entries.append((st.st_mtime, st.st_size, entry.path))
+    return entries
+
+def cache_size(cache_dir):
+    """
+    Return the total size of the results in the cache
+    """
+
+    return sum(size for mtime, size, path in cache_entries(cache_dir))
+
+def cache_trim(cache_dir, max_size):
+    """
+    Delete the least recently used results until the
+    cache is no bigger than TRIM_TO of max_size
+    """
+
+    entries = cache_entries(cache_dir)
+    total = sum(size for mtime, size, path in entries)
+
+    # Oldest first
+    entries.sort()
+    for mtime, size, path in entries:
+        if total <= max_size * TRIM_TO:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+    cache_sizes[cache_dir] = total
@@ -9,6 +9,10 @@ Extract Sneaky Payload from PNG Image's row filter information
 
 Usage:
 python3 png_sneak_decode.py input_file output_file
+or
+python3 png_sneak_decode.py --segment N input_file output_file
+or
+python3 png_sneak_decode.py --range START:END input_file output_file
 
 This stegonagraphic tool extracts a payload from a PNG file.
 It is assumed that the payload was encoded into the file using the
@@ -45,15 +49,29 @@ compression - filter value
     none    -   0
     zlib    -   1
     7-bit   -   2
+    segments-   3
+
+A first row filter of 3 marks a segmented container: an index of
+independently compressed segments, followed by the segments.
+(See png_sneak_encode.py for the layout.) A single segment, or a
+byte range of the combined payload, can be extracted with the
+--segment or --range options. Only the rows up to the end of the
+wanted data are read, and the IDAT data after them is never inflated.
+
+A first row filter of 4 means the payload carries on in the lengths
+of the IDAT chunks once the rows are used up, and the second row's
+filter holds the compression type. The chunk lengths are read from
+the chunk headers, without inflating anything.
     
 --------------------------------------------------------------------
 """
 
 import argparse
+import itertools
 # Use png From package purepng
 import png
+import struct
 import zlib
-from bitstring import BitStream
 
 # Global variables
 # I don't understand these. I feel like a script kiddie trying
@@ -62,6 +80,33 @@ from bitstring import BitStream
 # Global to indicate length of dashes '-' to output for print()
 num_dashes = 45
 
+# First row filter value used for the segmented container
+SEGMENTED = 3
+
+# Field sizes (in bits) of the segmented container index
+SEG_COUNT_BITS = 16
+SEG_SIZE_BITS = 32
+
+# Most decompressed bytes to inflate at a time while reading rows
+INFLATE_STEP = 65536
+
+# First row filter value used to flag the IDAT chunk length channel
+CHUNKED = 4
+
+# Most payload bits each IDAT chunk length may carry
+MAX_CHUNK_BITS = 16
+
+# Size (in bits) of the IDAT chunk length channel's bit count
+CHUNK_COUNT_BITS = 32
+
+# Names of the payload compression types
+compression_types = ["none", 
+                    "zlib", 
+                    "7-bit", 
+                    "segments", 
+                    "undefined"
+                    ]
+
 def to_bytes( bits, size=8, pad='0'):
     """
     Return a bytearray from a bitstream, padding as needed
@@ -71,31 +116,255 @@ def to_bytes( bits, size=8, pad='0'):
         chunks[-1] = chunks[-1].ljust(size, pad)
     return bytearray([int(c, 2) for c in chunks])
 
-def main():
+def parse_range(text, size):
     """
-    Extract the payload from a PNG file.
+    Return the (start, stop) byte offsets from a "START:END" string.
+    Either end may be left out or negative, like a python slice.
     """
     
-    parser = argparse.ArgumentParser()
-    parser.add_argument("input", help = "input file path")
-    parser.add_argument("output", help = "output file path")
-    args = parser.parse_args()
+    try:
+        start, stop = text.split(":")
+        start = int(start) if start else None
+        stop = int(stop) if stop else None
+    except ValueError:
+        raise SystemExit(
+            "ERROR: Range must look like START:END, not %s" % text
+            )
+    # Let python work out negative and out of range ends
+    start, stop, _ = slice(start, stop).indices(size)
+    return start, max(start, stop)
+
+def raw_rows(r, bytes_per_line):
+    """
+    Yield each row of the image, still filtered and with its
+    leading filter byte, one row at a time.
+
+    The IDAT data is inflated a piece at a time as rows are
+    requested, so nothing past the last requested row is inflated.
+    """
+    
+    d = zlib.decompressobj()
+    buf = bytearray()
+    for data in r.idat():
+        while data:
+            buf += d.decompress(data, INFLATE_STEP)
+            data = d.unconsumed_tail
+            # Hand out every complete row we have so far
+            offset = 0
+            while len(buf) - offset >= bytes_per_line:
+                yield buf[offset:offset + bytes_per_line]
+                offset += bytes_per_line
+            del buf[:offset]
+
+def row_filters(r, bytes_per_line):
+    """
+    Yield the row filter value of each row, one row at a time.
+    """
+    
+    for row in raw_rows(r, bytes_per_line):
+        yield row[0]
+
+def payload_bits(filters):
+    """
+    Yield the 2-bit strings carried by the row filters,
+    stopping at the filter = 4 EOF marker.
+    """
+    
+    # Convert the row filters into bits
+    # 0 = 00
+    # 1 = 01
+    # 2 = 10
+    # 3 = 11
+    # 4 = EOF
+    for row_filter in filters:
+        if row_filter == 4:
+            break
+        yield '{0:02b}'.format(row_filter)
+
+def idat_lengths(png_file):
+    """
+    Yield the length of each IDAT chunk, read from the chunk
+    headers alone. png_file is a file path or a seekable file object.
+    """
+    
+    f = png_file
+    if isinstance(png_file, str):
+        f = open(png_file, "rb")
+    try:
+        # Skip the PNG signature
+        f.seek(8)
+        while True:
+            head = f.read(8)
+            if len(head) < 8:
+                break
+            length, tag = struct.unpack("!I4s", head)
+            if tag == b"IEND":
+                break
+            if tag == b"IDAT":
+                yield length
+            # Skip the chunk data and CRC
+            f.seek(length + 4, 1)
+    finally:
+        if f is not png_file:
+            f.close()
+
+def chunk_bits(lengths):
+    """
+    Yield the 2-bit strings carried by the IDAT chunk lengths
+    """
+    
+    # The first chunk's length is the number of bits per chunk
+    per_chunk = next(lengths, 0)
+    if not 1 <= per_chunk <= MAX_CHUNK_BITS:
+        raise SystemExit(
+            "ERROR: No payload in IDAT chunk lengths:\n"
+            + "First IDAT Chunk Length = %s" % per_chunk
+            )
+
+    # Every other chunk carries its length minus one
+    def all_bits():
+        for length in lengths:
+            if not 1 <= length <= 2 ** per_chunk:
+                raise SystemExit(
+                    "ERROR: Bad IDAT chunk length for payload: %s" % length
+                    )
+            for bit in '{0:0{1}b}'.format(length - 1, per_chunk):
+                yield bit
+    bits = all_bits()
+
+    # Then comes the count of bits carried, then the bits
+    count = "".join(itertools.islice(bits, CHUNK_COUNT_BITS))
+    if len(count) != CHUNK_COUNT_BITS:
+        raise SystemExit("ERROR: IDAT chunk length payload is cut short")
+    for _ in range(int(count, 2) // 2):
+        pair = "".join(itertools.islice(bits, 2))
+        if len(pair) != 2:
+            raise SystemExit("ERROR: IDAT chunk length payload is cut short")
+        yield pair
+
+def take_bits(bit_src, count):
+    """
+    Return the next count bits from bit_src as a string
+    """
+    
+    # Stops as soon as bit_src runs out, however big count is
+    out_bits = "".join(itertools.islice(bit_src, count // 2))
+    if len(out_bits) != count:
+        raise SystemExit(
+            "ERROR: Payload ended early. Wanted %d bits, found %d"
+            % (count, len(out_bits))
+            )
+    return out_bits
+
+def unpack_payload(out_bits, compress, say=print):
+    """
+    Return the payload bytes from the encoded bits string
+    """
+    
+    # Nothing to unpack
+    if not out_bits:
+        return bytearray()
+
+    # If 7-bit, add back in the first bit (0)
+    if compress == 2:
+        # Remove any trailing pad bit if length is not a multiple of 7
+        if len(out_bits) % 7 > 0:
+            out_bits = out_bits[:-1]
+        # Insert a '0' before every 7-bits
+        n = 7
+        out_bits = '0' + '0'.join(
+                                out_bits[s:s+n] 
+                                for s in range(0, len(out_bits), n)
+                                )
+    
+    # make it a bytearray
+    out_bytes = to_bytes(out_bits)
 
+    # decompress if needed
+    if compress == 1:
+    
+        try:
+            # Attempt to decompress the payload
+            return bytearray(zlib.decompress(out_bytes, -15))
+        except Exception as e:
+            # Something broke
+            say("%s" % "-" * num_dashes)
+            raise SystemExit(
+            "ERROR Unable to decompress payload.\n%s" % (e)
+            )
+    return out_bytes
+
+def read_index(bit_src, max_bits=None):
+    """
+    Return the segmented container index as a list of
+    (compression type, payload size, encoded size) tuples
+
+    If max_bits is given, an index whose segments add up to more
+    bits than that can't be real, and is rejected.
+    """
+    
+    count = int(take_bits(bit_src, SEG_COUNT_BITS), 2)
+    index = []
+    total = SEG_COUNT_BITS
+    for _ in range(count):
+        compress = int(take_bits(bit_src, 2), 2)
+        raw_size = int(take_bits(bit_src, SEG_SIZE_BITS), 2)
+        seg_size = int(take_bits(bit_src, SEG_SIZE_BITS), 2)
+        index.append((compress, raw_size, seg_size))
+        total += 2 + 2 * SEG_SIZE_BITS + seg_size
+        if max_bits is not None and total > max_bits:
+            raise SystemExit(
+                "ERROR: Bad segment index. Needs %d bits, "
+                % total
+                + "image only holds %d" % max_bits
+                )
+    return index
+
+def read_segments(bit_src, index, wanted, say=print):
+    """
+    Return the payload bytes of the wanted segments, joined together.
+
+    Segments in front of the wanted ones are skipped over without
+    being unpacked, and reading stops after the last wanted one.
+    """
+    
+    raw_bytes = bytearray()
+    for n, (compress, raw_size, seg_size) in enumerate(index):
+        if n > max(wanted):
+            break
+        seg_bits = take_bits(bit_src, seg_size)
+        if n in wanted:
+            raw_bytes += unpack_payload(seg_bits, compress, say)
+    return raw_bytes
+
+def decode(png_file, segment=None, byte_range=None, verbose=False):
+    """
+    Return the payload bytes sneaked into a PNG.
+
+    png_file is a file path or a file object holding the PNG.
+    For a segmented container, segment picks out a single segment
+    and byte_range ("START:END") a byte range of the whole payload.
+    verbose prints the decoder's report as it goes.
+    """
+    
+    # The helpers below report through say as well
+    say = print if verbose else lambda *args: None
+    
     # Read in the input image, to get the needed info.
     # This will be used on the writer to (hopefully)
     # ensure the output PNG has the same pixel data
     # as the input PNG
-    print("%s" % "-" * num_dashes)
-    print("Input PNG: %s" % args.input)
-    print("%s" % "-" * num_dashes)
-    r = png.Reader(args.input)
+    say("%s" % "-" * num_dashes)
+    say("Input PNG: %s" % png_file)
+    say("%s" % "-" * num_dashes)
+    r = png.Reader(png_file)
     # Try to read it
     try:
         orig_png = r.read()
     # Exit with Error info it if didn't work
     except Exception as e:
         raise SystemExit(
-            "ERROR reading Input PNG File: %s\n%s" % (args.input, e)
+            "ERROR reading Input PNG File: %s\n%s" % (png_file, e)
             )
 
     # png.Reader() returns (width, height, pixels, metadata)
@@ -186,20 +455,8 @@ def main():
             )
     
     # Display it:
-    print("Bits Per Pixel: " + str(bits_per_pixel))
+    say("Bits Per Pixel: " + str(bits_per_pixel))
 
-    # Pull out the decompressed IDAT (pixel) data
-    data = list(r.idatdecomp())
-    
-    # Create bitstream
-    bits = BitStream()
-    
-    # Combine all chunks of data
-    # Note this attempts to do it all in one chunk
-    # IMPROVEMENT: process in multiple chunks for large files
-    for x in range(len(data)):
-        bits += BitStream( data[x] )
-    
     # Each line has a one-byte header containing the filter type
     # followed by [width] pixels, each of [bits_per_pixel] bits
     bits_per_line = 8 + width * bits_per_pixel
@@ -209,93 +466,131 @@ def main():
     if bits_per_line % 8 > 0:
         bits_per_line += 8 - bits_per_line % 8
 
-    # Initialize output bits string
-    out_bits = str()
-    
-    # Loop through each row of the image
-    for y in range(height):
-        # Determine the starting position of the line
-        start =  y * bits_per_line
-        # Take eight bits for the row filter byte
-        stop = start + 8
-        
-        # Pull out the row filter value in hex (base = 16)
-        row_filter = int(str(bits[start:stop]), 16)
-        # print ("Row: %d Filter:  %d" % (y, row_filter))
-        
-        # First row's filter indicates compression type
-        # 0   = none
-        # 1   = zlib
-        # 2   = 7-bit
-        # 3-4 = undefined
-        if y == 0:
-            # Determine compression type
-            if 0 <= row_filter <= 2:
-                compress = row_filter
-                compression_types = ["none", 
-                                    "zlib", 
-                                    "7-bit", 
-                                    "undefined", 
-                                    "undefined"
-                                    ]
-                print("Payload compression type: %s"
-                    % compression_types[compress]
-                    )
-            else:
+    # Walk the row filters one row at a time, inflating
+    # the IDAT data only as far as the rows we read
+    filters = row_filters(r, bits_per_line // 8)
+
+    # First row's filter indicates compression type
+    # 0   = none
+    # 1   = zlib
+    # 2   = 7-bit
+    # 3   = segmented container
+    # 4   = IDAT chunk length channel in use,
+    #       second row's filter indicates compression type
+    compress = next(filters, None)
+    chunked = compress == CHUNKED
+    if chunked:
+        say("Payload continues in IDAT chunk lengths")
+        compress = next(filters, None)
+    if compress is not None and 0 <= compress <= 3:
+        say("Payload compression type: %s"
+            % compression_types[compress]
+            )
+    else:
+        raise SystemExit(
+            "ERROR: Undefined payload compression method:\n"
+            + "First Row Filter = %s" % compress
+            )
+
+    # The remaining rows carry the payload bits
+    bit_src = payload_bits(filters)
+
+    # Followed by the IDAT chunk lengths, if in use.
+    # These are only read once the rows run out.
+    # (By then the rows are done with png_file, if it's a file object)
+    if chunked:
+        bit_src = itertools.chain(
+            bit_src, chunk_bits(idat_lengths(png_file))
+            )
+
+    if compress == SEGMENTED:
+        # Read the index, then only the segments we were asked for
+        # Each row holds 2 bits, unless the chunk lengths hold more
+        max_bits = None
+        if not chunked:
+            max_bits = 2 * height
+        index = read_index(bit_src, max_bits)
+        say("Segments: %d" % len(index))
+        say("%s" % "-" * num_dashes)
+        say("  #  type       size   offset")
+        offset = 0
+        for n, (seg_compress, raw_size, seg_size) in enumerate(index):
+            say("%3d  %-5s %9d %8d"
+                % (n, compression_types[seg_compress], raw_size, offset)
+                )
+            offset += raw_size
+        say("%s" % "-" * num_dashes)
+
+        if segment is not None:
+            # A single segment
+            if not 0 <= segment < len(index):
                 raise SystemExit(
-                    "ERROR: Undefined payload compression method:\n"
-                    + "First Row Filter = %s" % compress
+                    "ERROR: No segment %d in payload" % segment
                     )
-                    
-        # Convert the row filters for the remaining lines into bits
-        # 0 = 00
-        # 1 = 01
-        # 2 = 10
-        # 3 = 11
-        # 4 = ignore
+            raw_bytes = read_segments(bit_src, index, [segment], say)
+        elif byte_range is not None:
+            # A byte range of the combined payload
+            # Find the segments that cover it
+            start, stop = parse_range(byte_range, offset)
+            wanted = []
+            first = 0
+            seg_start = 0
+            for n, (seg_compress, raw_size, seg_size) in enumerate(index):
+                seg_stop = seg_start + raw_size
+                if seg_start < stop and start < seg_stop:
+                    if not wanted:
+                        first = seg_start
+                    wanted.append(n)
+                seg_start = seg_stop
+            raw_bytes = bytearray()
+            if wanted:
+                raw_bytes = read_segments(bit_src, index, wanted, say)
+            raw_bytes = raw_bytes[start - first:stop - first]
         else:
-            if row_filter != 4:
-                # Pull out the two data bits
-                out_bits += str('{0:02b}'.format(row_filter))
-            else:
-                # filter = 4 indicates EOF
-                break
-    
-    # Print the compressed payload info
-    if compress:
-        print("Compressed Payload Length: %d bytes" 
-            % (len(out_bits) / 8)
-            )
+            # Everything
+            raw_bytes = bytearray()
+            if index:
+                raw_bytes = read_segments(
+                    bit_src, index, range(len(index)), say
+                    )
+    else:
+        if segment is not None or byte_range is not None:
+            raise SystemExit(
+                "ERROR: --segment and --range need a segmented payload"
+                )
+        out_bits = "".join(bit_src)
 
-    # If 7-bit, add back in the first bit (0)
-    if compress == 2:
-        # Remove any trailing pad bit if length is not a multiple of 7
-        if len(out_bits) % 7 > 0:
-            out_bits = out_bits[:-1]
-        # Insert a '0' before every 7-bits
-        n = 7
-        out_bits = '0' + '0'.join(
-                                out_bits[s:s+n] 
-                                for s in range(0, len(out_bits), n)
-                                )
-    
-    # make it a bytearray
-    out_bytes = to_bytes(out_bits)
+        # Print the compressed payload info
+        if compress:
+            say("Compressed Payload Length: %d bytes" 
+                % (len(out_bits) / 8)
+                )
 
-    # decompress if needed
-    if compress == 1:
+        raw_bytes = unpack_payload(out_bits, compress, say)
+
+    return raw_bytes
+
+def main():
+    """
+    Extract the payload from a PNG file.
+    """
     
-        try:
-            # Attempt to decompress the payload
-            raw_bytes = zlib.decompress(out_bytes, -15)
-        except Exception as e:
-            # Something broke
-            print("%s" % "-" * num_dashes)
-            raise SystemExit(
-            "ERROR Unable to decompress payload.\n%s" % (e)
-            )
-    else:
-        raw_bytes = out_bytes
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help = "input file path")
+    parser.add_argument("output", help = "output file path")
+    parser.add_argument("--segment", 
+                        type = int,
+                        help = "extract only this segment"
+                        )
+    parser.add_argument("--range", 
+                        help = "extract only bytes START:END "
+                        + "of the payload (negative ends count from "
+                        + "the end, e.g. --range=-10:)"
+                        )
+    args = parser.parse_args()
+
+    raw_bytes = decode(args.input, args.segment, args.range,
+                       verbose=True)
 
     # Display the info
     print("Payload Length: %s bytes" % len(raw_bytes))
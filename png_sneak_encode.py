@@ -13,6 +13,12 @@ Usage:
 python3 png_sneak_encode.py input_file output_file payload_file
 or 
 python3 png_sneak_encode.py input_file output_file "payload string"
+or
+python3 png_sneak_encode.py [--segment-size BYTES] [--chunk-bits N]
+                            input_file output_file payload [payload ...]
+
+Add --verify to check that the output has the same pixel data as the
+input once it is written. (See png_sneak_verify.py)
 
 This stegonagraphic tool encodes a payload into a PNG file.
 The payload can be provided as a file or a string literal.
@@ -49,6 +55,37 @@ compression - filter value
     none    -   0
     zlib    -   1
     7-bit   -   2
+    segments-   3
+
+When more than one payload is given, or --segment-size is used,
+the payload is stored as a segmented container (first row filter 3).
+Each segment is compressed on its own (none, zlib or 7-bit) and an
+index at the front of the bitstream lists every segment:
+
+    segment count           - 16 bits
+    then for each segment:
+        compression type    -  2 bits
+        payload size        - 32 bits (bytes, before compression)
+        encoded size        - 32 bits (bits, as stored in the rows)
+
+The segments follow the index back to back, so the decoder can
+find any one of them from the index alone and stop reading rows
+(and inflating the IDAT data) once it has what it needs.
+
+Capacity is 2 bits per row, which isn't much for short, wide images.
+With --chunk-bits N, payload bits that don't fit in the rows are
+carried in the lengths of the IDAT chunks instead. How the zlib
+stream is split across IDAT chunks doesn't affect the pixels, and the
+decoder can read the lengths from the chunk headers without inflating
+anything. The first row's filter is then 4, and the second row's
+filter holds the compression type. The IDAT chunks are:
+
+    first chunk             - length N (bits per chunk, 1-16)
+    next chunks             - a 32 bit count of the bits carried
+    next chunks             - the bits
+    remaining chunks        - the rest of the zlib stream
+
+Each chunk after the first carries N bits as its length minus one.
     
 --------------------------------------------------------------------
 """
@@ -61,27 +98,33 @@ import os.path
 import png
 import zlib
 from bitstring import BitStream
+from png_sneak_verify import verify
 
 # Global variables
-# I don't understand these. I feel like a script kiddie trying
-# to make big. But the code appears to work when I do this.
+# The state of an encode in progress (current row, compression
+# style, payload bits and EOF indicator) used to live here too.
+# It now lives in the 'stego' filter_type dict handed to png.Writer,
+# which passes it back to adapt_stego() as cfg for every row, so
+# several encodes can run at once in the same process.
 
-# Global that keeps track of the current row
-# Used to allow the first row to encode the compression type
-# while the rest of the rows encode the payload
-cur_row = 0
+# Global to indicate length of dashes '-' to output for print()
+num_dashes = 45
 
-# Global that indicates the compression style for the payload
-compress = 0
+# First row filter value used for the segmented container
+SEGMENTED = 3
 
-# Global used for the bits of the payload.
-bits = BitStream()
+# Field sizes (in bits) of the segmented container index
+SEG_COUNT_BITS = 16
+SEG_SIZE_BITS = 32
 
-# Global used to know if the filter=4 EOF indicator has been placed
-eof = False
+# First row filter value used to flag the IDAT chunk length channel
+CHUNKED = 4
 
-# Global to indicate length of dashes '-' to output for print()
-num_dashes = 45
+# Most payload bits each IDAT chunk length may carry
+MAX_CHUNK_BITS = 16
+
+# Size (in bits) of the IDAT chunk length channel's bit count
+CHUNK_COUNT_BITS = 32
 
 def adapt_stego(line, cfg, filter_obj):
     """
@@ -96,35 +139,51 @@ def adapt_stego(line, cfg, filter_obj):
         0   = none
         1   = zlib
         2   = 7-bit
-        3-4 = undefined
+        3   = segmented container
+        4   = IDAT chunk length channel in use, the second
+              row then holds the compression type
 
     The encoding patterns for other rows are:
         0-3 = 2 bits of payload
         4   = unused / ignored by decoder
+
+    cfg holds the state of the encode (see new_stego_cfg())
     """
     
-    # Keeps track of which row we're on
-    global cur_row
-    
-    # Stores the compression type
-    global compress
-    
     # Calculate all the possible filtered lines
     lines = filter_obj.filter_all(line)
     
     # Pick the line we need
-    if cur_row == 0:
-        # The first line encodes the compression type
-        result = lines[compress]
+    if cfg["cur_row"] < len(cfg["header"]):
+        # The first line(s) encode the compression type
+        result = lines[cfg["header"][cfg["cur_row"]]]
     else:
         # Remaining lines encode the payload
         filter = stego(line, cfg, filter_obj)
         result = lines[filter]
         
     # Increment the row counter
-    cur_row += 1
+    cfg["cur_row"] += 1
     return result
 
+def new_stego_cfg(header, bits):
+    """
+    Return the 'stego' filter_type dict for png.Writer,
+    holding the state of one encode
+    """
+    
+    return {"name": "stego",
+            # Keeps track of which row we're on
+            "cur_row": 0,
+            # The filter values for the first row(s), which hold
+            # the compression type
+            "header": header,
+            # The bits of the payload, for the other rows
+            "bits": bits,
+            # Whether the filter=4 EOF indicator has been placed
+            "eof": False,
+            }
+
 def getBytes(filename):
     """
     Return the bytes from a file
@@ -155,23 +214,181 @@ def is_ascii(text):
             return False
     return True
 
+def pack_payload(raw_bytes, say=print):
+    """
+    Return the (compression type, bits) pair for the smallest
+    encoding of the payload bytes.
+
+    The compression types are:
+        0   = none
+        1   = zlib
+        2   = 7-bit
+    """
+    
+    # Calculate the size of the raw payload
+    raw_size = len(raw_bytes)
+    say ("raw:   %s bytes" % raw_size)
+
+    # Create the list of sizes for determining which one to use
+    sizes = [raw_size]
+
+    # Compress the raw payload using zlib
+    # Remove the zlib header/tail using wbits = -15.
+    # this option appears only available using the compressobj()
+    # instead of the compress() function
+    # Note this attempts to do it all in one chunk.
+    # IMPROVEMENT: process in multiple chunks for large payloads
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+    compressed_bytes = compressor.compress(raw_bytes)
+    compressed_bytes += compressor.flush()
+
+    # Calculate the size of the compressed payload
+    zlib_size = len(compressed_bytes)
+    say ("zlib:  %s bytes" % zlib_size)
+    sizes.append(zlib_size)
+
+    # Check if the input is pure-ASCII
+    if is_ascii(raw_bytes):
+        say ("Input is pure ASCII\nwill attempt 7-bit option")
+        ascii_bits = BitStream(raw_bytes)
+        # Remove the first bit from each byte
+        # as it is '0' for ASCII characters
+        del ascii_bits[::8]
+        # calculate the length in bits
+        ascii_len = len(ascii_bits)
+        # We work with groups of 2 bits, so length must be even.
+        # Pad with a trailing '0' if needed
+        if ascii_len % 2 > 0:
+            ascii_bits += BitStream("0b0")
+        # Calculate the length in bytes
+        ascii_size = len(ascii_bits) / 8
+        say ("7-bit: %s bytes" % ascii_size)
+        sizes.append(ascii_size)
+
+        # Little diversion note...
+        # I tried to be clever and beat zlib by compressing this 7-bit
+        # per symbol version of pure ASCII input. Nope, didn't work!
+        # zlib does a *much* better job of compressing ASCII text with
+        # 8-bit characters than my 7-bit per character attempt.
+        # Turns out zlib operates on bytes, so the 7-bit per character
+        # input gets read as 8-bits per symbol, thus screwing up the
+        # dictionary as more than 128 possible 8-bit characters can be
+        # present.
+        # oh well. Lesson learned.
+
+    # Set payload compression style
+    # 0 = none / raw
+    # 1 = zlib
+    # 2 = 7-bit
+
+    # Find the smallest byte size of the options
+    min_size_index = sizes.index(min(sizes))
+    if min_size_index == 0:
+        say("Using: Raw Option")
+        compress = 0
+        bits = BitStream(raw_bytes)
+    elif min_size_index == 1:
+        say("Using: zlib Option")
+        compress = 1
+        bits = BitStream(compressed_bytes)
+    elif min_size_index == 2:
+        say("Using: 7-bit Option")
+        compress = 2
+        # this is already a BitStream
+        bits = ascii_bits
+
+    return compress, bits
+
+def pack_segments(segments, say=print):
+    """
+    Return the bits of a segmented container holding the
+    given list of payload segments.
+
+    Each segment is packed on its own, so it can later be
+    extracted without touching the others.
+    """
+    
+    # The segment count has to fit in the index
+    if len(segments) >= 2 ** SEG_COUNT_BITS:
+        raise SystemExit(
+            "ERROR: Too many segments: %d" % len(segments)
+            )
+
+    # Holds the packed bits of each segment, in order
+    packed = []
+    for n, raw_bytes in enumerate(segments):
+        say("Segment %d:" % n)
+        compress, seg_bits = pack_payload(raw_bytes, say)
+        packed.append((compress, len(raw_bytes), seg_bits))
+        say()
+
+    # The index goes first: segment count, then one entry per segment
+    result = BitStream(uint=len(packed), length=SEG_COUNT_BITS)
+    for compress, raw_size, seg_bits in packed:
+        result += BitStream(uint=compress, length=2)
+        result += BitStream(uint=raw_size, length=SEG_SIZE_BITS)
+        result += BitStream(uint=seg_bits.len, length=SEG_SIZE_BITS)
+
+    # Followed by the segment data, back to back
+    for compress, raw_size, seg_bits in packed:
+        result += seg_bits
+
+    return result
+
+def split_idat(stream, bits, chunk_bits, chunk_limit, say=print):
+    """
+    Return the zlib stream split up into IDAT chunks whose
+    lengths carry the given bits, chunk_bits at a time.
+
+    The first chunk's length is chunk_bits itself. Then come
+    chunks carrying a CHUNK_COUNT_BITS count of the bits, then
+    chunks carrying the bits. Each chunk is one byte longer than
+    the value it carries, so none are empty. Whatever is left of
+    the stream follows in chunks of up to chunk_limit bytes.
+    """
+    
+    channel = BitStream(uint=bits.len, length=CHUNK_COUNT_BITS) + bits
+    # Pad to a whole number of chunks
+    if channel.len % chunk_bits > 0:
+        channel += BitStream(chunk_bits - channel.len % chunk_bits)
+
+    lengths = [chunk_bits]
+    for value in channel.cut(chunk_bits):
+        lengths.append(value.uint + 1)
+
+    # The stream has to be long enough to cut up that way
+    say("IDAT bytes needed:   %s" % sum(lengths))
+    say("IDAT bytes provided: %s" % len(stream))
+    if sum(lengths) > len(stream):
+        say("%s" % "-" * num_dashes)
+        raise SystemExit(
+            "ERROR: Image too small. Need %s bytes of IDAT data "
+            % sum(lengths)
+            + "to encode paylod"
+            )
+
+    chunks = []
+    pos = 0
+    for length in lengths:
+        chunks.append(stream[pos:pos + length])
+        pos += length
+    for start in range(pos, len(stream), chunk_limit):
+        chunks.append(stream[start:start + chunk_limit])
+    return chunks
+
 def stego(line, cfg, filter_obj):
     """
     Return 2 bits at a time until out of bits, then return 4
     """
     
-    # This seems to work with or without the global indicator for bits
-    # I don't know why?
-    global bits
-    
-    # Indicates we've put the filter=4 End of File indicator at the end
-    global eof
+    # The bits of the payload
+    bits = cfg["bits"]
     
     result = 4
     if (bits.len - bits._pos) > 1:
         # As long as there are bits to encode...
         result = bits.read("uint:2")
-    elif eof:
+    elif cfg["eof"]:
         # No more bits and We've already put the 
         # EOF (filter=4) indicator in there
         lines = filter_obj.filter_all(line)
@@ -196,50 +413,61 @@ def stego(line, cfg, filter_obj):
         # No more bits, time to put in the EOF
         result = 4
         # Indicate we've placed the EOF
-        eof = True
+        cfg["eof"] = True
         
     return result
 
-def main():
+def read_payloads(items):
     """
-    Import the input PNG file and the payload. Create the output PNG
+    Return the payload bytes for each item, which is a
+    file path, a payload string or already bytes
     """
     
-    # I don't understand global variables, but the code seems to work
-    # when I do this.
-    global bits
-    global compress
-    global cur_row
+    # Convert the payload(s) into bytes
+    # Check if each is a file or a string
+    payloads = []
+    for payload in items:
+        if isinstance(payload, (bytes, bytearray)):
+            payloads.append(bytearray(payload))
+        elif os.path.isfile(payload):
+            payloads.append(bytearray(getBytes(payload)))
+        else:
+            payloads.append(bytearray(payload, encoding="utf8"))
+    return payloads
+
+def encode(cover, output, payloads, segment_size=0, chunk_bits=0,
+           verbose=False):
+    """
+    Sneak the payloads into the cover PNG, writing the
+    new PNG to output.
+
+    cover is a file path or a file object holding the input PNG,
+    output is a file path or a file object opened for binary writing
+    and payloads is a list of payload bytes. More than one payload,
+    or a segment_size, makes a segmented container. A chunk_bits
+    of 1 to MAX_CHUNK_BITS stores the payload bits that don't fit
+    in the rows in the IDAT chunk lengths, that many bits per chunk.
+    verbose prints the encoder's report as it goes.
+    """
+    
+    # The helpers below report through say as well
+    say = print if verbose else lambda *args: None
     
-    # Define and Import the arguments
-    # all are required
-    parser = argparse.ArgumentParser()
-    parser.add_argument("input", 
-                        help = "input file path"
-                        )
-    parser.add_argument("output", 
-                        help = "output file path"
-                        )
-    parser.add_argument("payload",
-                        help = "payload file path or payload string"
-                        )
-    args = parser.parse_args()
-
     # Read in the input image, to get the needed info.
     # This will be used on the writer to (hopefully)
     # ensure the output PNG has the same pixel data
     # as the input PNG
-    print("%s" % "-" * num_dashes)
-    print("Input PNG: %s" % args.input)
-    print("%s" % "-" * num_dashes)
-    r = png.Reader(args.input)
+    say("%s" % "-" * num_dashes)
+    say("Input PNG: %s" % cover)
+    say("%s" % "-" * num_dashes)
+    r = png.Reader(cover)
     # Try to read it
     try:
         orig_png = r.read()
     # Exit with Error info it if didn't work
     except Exception as e:
         raise SystemExit(
-            "ERROR reading Input PNG File: %s\n%s" % (args.input, e)
+            "ERROR reading Input PNG File: %s\n%s" % (cover, e)
             )
 
     # png.Reader() returns (width, height, pixels, metadata)
@@ -274,109 +502,73 @@ def main():
     icc_profile_name = meta.get("icc_profile_name", "ICC Profile")
 
     # Print out some of the info
-    print("Width:       %d" % width)
-    print("Height:      %d" % height)
-    print("Greyscale:   %s" % greyscale)
-    print("Alpha:       %s" % alpha)
-    print("Bitdepth:    %s" % bitdepth)
-    print("Palette Len: %s" % palette_length)
-    print()
+    say("Width:       %d" % width)
+    say("Height:      %d" % height)
+    say("Greyscale:   %s" % greyscale)
+    say("Alpha:       %s" % alpha)
+    say("Bitdepth:    %s" % bitdepth)
+    say("Palette Len: %s" % palette_length)
+    say()
 
     # Grab the pixel data
     orig_pixels = orig_png[2]
 
-    # Convert the payload into bytes
-    # Check if it's a file or a string
-    if os.path.isfile(args.payload):
-        raw_bytes = bytearray(getBytes(args.payload))
+    if len(payloads) == 1 and segment_size <= 0:
+        # Pick the smallest encoding of the payload
+        compress, bits = pack_payload(payloads[0], say)
     else:
-        raw_bytes = bytearray(args.payload, encoding="utf8")
-
-    # Calculate the size of the raw payload
-    raw_size = len(raw_bytes)
-    print ("raw:   %s bytes" % raw_size)
-
-    # Create the list of sizes for determining which one to use
-    sizes = [raw_size]
-
-    # Compress the raw payload using zlib
-    # Remove the zlib header/tail using wbits = -15.
-    # this option appears only available using the compressobj()
-    # instead of the compress() function
-    # Note this attempts to do it all in one chunk.
-    # IMPROVEMENT: process in multiple chunks for large payloads
-    compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
-    compressed_bytes = compressor.compress(raw_bytes)
-    compressed_bytes += compressor.flush()
-
-    # Calculate the size of the compressed payload
-    zlib_size = len(compressed_bytes)
-    print ("zlib:  %s bytes" % zlib_size)
-    sizes.append(zlib_size)
-
-    # Check if the input is pure-ASCII
-    if is_ascii(raw_bytes):
-        print ("Input is pure ASCII\nwill attempt 7-bit option")
-        ascii_bits = BitStream(raw_bytes)
-        # Remove the first bit from each byte
-        # as it is '0' for ASCII characters
-        del ascii_bits[::8]
-        # calculate the length in bits
-        ascii_len = len(ascii_bits)
-        # We work with groups of 2 bits, so length must be even.
-        # Pad with a trailing '0' if needed
-        if ascii_len % 2 > 0:
-            ascii_bits += BitStream("0b0")
-        # Calculate the length in bytes
-        ascii_size = len(ascii_bits) / 8
-        print ("7-bit: %s bytes" % ascii_size)
-        sizes.append(ascii_size)
-
-        # Little diversion note...
-        # I tried to be clever and beat zlib by compressing this 7-bit
-        # per symbol version of pure ASCII input. Nope, didn't work!
-        # zlib does a *much* better job of compressing ASCII text with
-        # 8-bit characters than my 7-bit per character attempt.
-        # Turns out zlib operates on bytes, so the 7-bit per character
-        # input gets read as 8-bits per symbol, thus screwing up the
-        # dictionary as more than 128 possible 8-bit characters can be
-        # present.
-        # oh well. Lesson learned.
-
-    # Set payload compression style
-    # 0 = none / raw
-    # 1 = zlib
-    # 2 = 7-bit
-
-    # Find the smallest byte size of the options
-    min_size_index = sizes.index(min(sizes))
-    if min_size_index == 0:
-        print("Using: Raw Option")
-        compress = 0
-        bits = BitStream(raw_bytes)
-    elif min_size_index == 1:
-        print("Using: zlib Option")
-        compress = 1
-        bits = BitStream(compressed_bytes)
-    elif min_size_index == 2:
-        print("Using: 7-bit Option")
-        compress = 2
-        # this is already a BitStream
-        bits = ascii_bits
+        # Each payload is a segment, unless a segment size was
+        # given, in which case each payload is split up further
+        segments = []
+        for raw_bytes in payloads:
+            if segment_size <= 0:
+                segments.append(raw_bytes)
+                continue
+            # An empty payload still gets its (empty) segment, so
+            # segment numbers don't depend on the segment size
+            for start in range(0, max(len(raw_bytes), 1), segment_size):
+                segments.append(
+                    raw_bytes[start:start + segment_size]
+                    )
+        say("Using: Segmented Container (%d segments)" % len(segments))
+        compress = SEGMENTED
+        bits = pack_segments(segments, say)
 
     # Add a blank line to the output
-    print()
-
-    # Need 2 extra bits for the compression style
-    bits_to_encode = bits.len + 2
-    print("bits to encode: %s" % str(bits_to_encode))
+    say()
+
+    # The first row holds the compression style
+    header = [compress]
+    chunk_payload = None
+    if chunk_bits:
+        if not 1 <= chunk_bits <= MAX_CHUNK_BITS:
+            raise SystemExit(
+                "ERROR: Chunk bits must be 1 to %d" % MAX_CHUNK_BITS
+                )
+        if interlace or height < 2:
+            raise SystemExit(
+                "ERROR: Chunk bits need a non-interlaced image "
+                + "at least 2 rows high"
+                )
+        # The first row flags the IDAT chunk length channel,
+        # and the second holds the compression style.
+        header = [CHUNKED, compress]
+        # Whatever doesn't fit in the rows goes in the chunk lengths
+        row_capacity = 2 * (height - len(header))
+        chunk_payload = bits[row_capacity:]
+        bits = bits[:row_capacity]
+        say("bits in chunks: %s" % str(chunk_payload.len))
+
+    # Need 2 extra bits for each header row
+    bits_to_encode = bits.len + 2 * len(header)
+    say("bits to encode: %s" % str(bits_to_encode))
 
     # Each row can hold 2 bits
     required_rows = int(bits_to_encode / 2)
-    print("rows needed:    %s" % required_rows)
-    print("rows provided:  %s" % height)
+    say("rows needed:    %s" % required_rows)
+    say("rows provided:  %s" % height)
     if(required_rows > height):
-        print("%s" % "-" * num_dashes)
+        say("%s" % "-" * num_dashes)
         raise SystemExit(
             "ERROR: Image too small. Need %s rows to encode paylod"
             % required_rows
@@ -385,19 +577,7 @@ def main():
     # Set the custom filter_type for packing
     # the payload into the filter values
     png.register_extra_filter(adapt_stego, "stego")
-    filter_type = "stego"
-
-    # Write out the output file
-    # Using the PNG parameters pulled from the input
-    # file, except for the 'filter_type' which was changed
-    # Try to open it
-    try:
-        f = open(args.output, "wb")
-    # Exit with Error info it if didn't work
-    except Exception as e:
-        raise SystemExit(
-            "ERROR opening Output PNG File: %s\n%s" % (args.output, e)
-            )
+    filter_type = new_stego_cfg(header, bits)
 
     # Create the writer with the Input PNG file's parameters
     # (except for the filter_type, which is the whole point)
@@ -418,16 +598,95 @@ def main():
                     icc_profile_name
                     )
 
+    # When the chunk lengths carry payload, compress the whole
+    # image first, then cut the zlib stream into IDAT chunks
+    # whose lengths carry the rest of the payload.
+    # (Done before opening the output, in case it doesn't fit)
+    idat_chunks = None
+    if chunk_payload is not None:
+        try:
+            stream = b"".join(w.idat(orig_pixels))
+        # Exit with Error info it if didn't work
+        except Exception as e:
+            raise SystemExit(
+                "ERROR compressing Output PNG File: %s\n%s" % (output, e)
+                )
+        idat_chunks = split_idat(
+            stream, chunk_payload, chunk_bits, chunk_limit, say
+            )
+
+    # Write out the output file
+    # Try to open it, unless we were handed an open file
+    f = output
+    if isinstance(output, str):
+        try:
+            f = open(output, "wb")
+        # Exit with Error info it if didn't work
+        except Exception as e:
+            raise SystemExit(
+                "ERROR opening Output PNG File: %s\n%s" % (output, e)
+                )
+
     # Try to write it
     try:
-        w.write(f, orig_pixels)
+        if idat_chunks is None:
+            w.write(f, orig_pixels)
+        else:
+            w.write_idat(f, idat_chunks)
     # Exit with Error info it if didn't work
     except Exception as e:
         raise SystemExit(
-            "ERROR writing Output PNG File: %s\n%s" % (args.output, e)
+            "ERROR writing Output PNG File: %s\n%s" % (output, e)
             )
     finally:
-        f.close()
+        if f is not output:
+            f.close()
+
+def main():
+    """
+    Import the input PNG file and the payload. Create the output PNG
+    """
+    
+    # Define and Import the arguments
+    # all are required
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", 
+                        help = "input file path"
+                        )
+    parser.add_argument("output", 
+                        help = "output file path"
+                        )
+    parser.add_argument("payload",
+                        nargs = "+",
+                        help = "payload file path(s) or payload string(s)"
+                        )
+    parser.add_argument("--segment-size",
+                        type = int,
+                        default = 0,
+                        help = "split the payload into segments of "
+                        + "this many bytes"
+                        )
+    parser.add_argument("--chunk-bits",
+                        type = int,
+                        default = 0,
+                        help = "carry payload that doesn't fit in the "
+                        + "rows in the IDAT chunk lengths, this many "
+                        + "bits per chunk (1-%d)" % MAX_CHUNK_BITS
+                        )
+    parser.add_argument("--verify",
+                        action = "store_true",
+                        help = "check the output has the same pixels "
+                        + "as the input"
+                        )
+    args = parser.parse_args()
+
+    # Convert the payload(s) into bytes
+    payloads = read_payloads(args.payload)
+
+    # Sneak it in
+    encode(args.input, args.output, payloads, args.segment_size,
+           args.chunk_bits, verbose=True
+           )
 
     # Print results summary
     print("%s" % "-" * num_dashes)
@@ -435,5 +694,13 @@ def main():
     print("%s" % "-" * num_dashes)
     print("Output PNG: %s" % args.output)
 
+    # Check the pixels really are unchanged
+    if args.verify:
+        result = verify(args.input, args.output)
+        if result is not None:
+            print("%s" % "-" * num_dashes)
+            raise SystemExit("ERROR: Pixel data changed: %s" % result)
+        print("Pixel data verified")
+
 if __name__ == "__main__":
     main()
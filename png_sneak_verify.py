@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# --------------------------------------------------------------------
+# png_sneak_verify.py - Check that a Sneaky PNG image file has the
+#                       same pixel data as the image it came from
+#
+# By timescape
+# --------------------------------------------------------------------
+"""
+Check that the pixel data of two PNG images is identical
+
+Usage:
+python3 png_sneak_verify.py cover_file output_file
+
+The encoder promises to leave the pixel data untouched (hopefully).
+This tool checks it, without fully decoding either image.
+
+Both images are read side by side, one row at a time. Each row is
+inflated and unfiltered on its own and compared byte for byte with
+the matching row of the other image, stopping at the first row that
+differs. Only a couple of rows from each image are held in memory
+at once, so the check runs in constant memory at about inflate speed.
+
+The image headers (size, bit depth, color type, palette and
+transparency) are compared first, as the same row bytes mean
+different pixels when they differ.
+
+Interlaced images can't be unfiltered a row at a time, so they are
+compared pixel row by pixel row after a full read instead.
+
+The exit status is 0 when the pixel data matches, 1 when it doesn't.
+--------------------------------------------------------------------
+"""
+
+import argparse
+import itertools
+# Use png From package purepng
+import png
+from png_sneak_decode import raw_rows
+
+# Global to indicate length of dashes '-' to output for print()
+num_dashes = 45
+
+def open_png(filename):
+    """
+    Return a png.Reader for the file, with its header already read
+    """
+
+    r = png.Reader(filename)
+    # Try to read the header
+    try:
+        r.preamble()
+    # Exit with Error info it if didn't work
+    except Exception as e:
+        raise SystemExit(
+            "ERROR reading PNG File: %s\n%s" % (filename, e)
+            )
+    return r
+
+def scanlines(r):
+    """
+    Yield each unfiltered row of the image, one row at a time
+    """
+
+    # Undoing a filter needs the previous row, which filt keeps
+    filt = png.Filter(r.bitdepth * r.planes)
+    for row in raw_rows(r, r.row_bytes + 1):
+        if row[0] > 4:
+            raise png.FormatError("Invalid PNG Filter Type %d" % row[0])
+        scanline = row[1:]
+        filt.undo_filter(row[0], scanline)
+        yield scanline
+
+def header(r):
+    """
+    Return the header values that decide what the row bytes mean
+    """
+
+    palette = None
+    if r.colormap:
+        palette = r.palette()
+    return [("size", (r.width, r.height)),
+            ("bitdepth", r.bitdepth),
+            ("color type", r.color_type),
+            ("interlace", r.interlace),
+            ("palette", palette),
+            ("transparent", getattr(r, "transparent", None)),
+            ]
+
+def verify(cover_file, output_file):
+    """
+    Compare the pixel data of two PNG files.
+
+    Return None when they match, otherwise a message
+    describing the first difference found.
+    """
+
+    cover = open_png(cover_file)
+    output = open_png(output_file)
+
+    # Headers first
+    for (name, a), (_, b) in zip(header(cover), header(output)):
+        if a != b:
+            return "%s differs: %s != %s" % (name, a, b)
+
+    # Then the rows, one at a time
+    if cover.interlace:
+        cover_rows = cover.read()[2]
+        output_rows = output.read()[2]
+    else:
+        cover_rows = scanlines(cover)
+        output_rows = scanlines(output)
+
+    try:
+        rows = itertools.zip_longest(cover_rows, output_rows)
+        for y, (a, b) in enumerate(rows):
+            if a is None or b is None:
+                return "row count differs at row %d" % y
+            if a != b:
+                return "row %d differs" % y
+            if y >= cover.height:
+                return "extra rows after row %d" % cover.height
+    except Exception as e:
+        return "unable to read rows: %s" % e
+
+    return None
+
+def main():
+    """
+    Check that the output PNG has the same pixels as the cover PNG
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cover", help = "cover (original) file path")
+    parser.add_argument("output", help = "output (encoded) file path")
+    args = parser.parse_args()
+
+    print("%s" % "-" * num_dashes)
+    print("Cover PNG:  %s" % args.cover)
+    print("Output PNG: %s" % args.output)
+    print("%s" % "-" * num_dashes)
+
+    result = verify(args.cover, args.output)
+    if result is not None:
+        raise SystemExit("MISMATCH: %s" % result)
+    print("Pixel data matches")
+
+if __name__ == "__main__":
+    main()
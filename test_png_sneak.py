@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# --------------------------------------------------------------------
+# test_png_sneak.py - Round trip checks for the payload formats
+#
+# By timescape
+# --------------------------------------------------------------------
+"""
+Round trip checks for the encoder and decoder
+
+Usage:
+python3 -m pytest test_png_sneak.py
+(or python3 -m unittest test_png_sneak)
+
+Each check sneaks payloads into a random cover image and reads them
+back out, so a change to one of the on-disk formats that breaks
+decoding shows up here.
+--------------------------------------------------------------------
+"""
+
+import io
+import os
+import unittest
+from unittest import mock
+# Use png From package purepng
+import png
+from bitstring import BitStream
+import png_sneak_encode
+from png_sneak_decode import decode
+from png_sneak_encode import SEG_COUNT_BITS, SEG_SIZE_BITS, encode
+
+def make_cover(width, height):
+    """
+    Return the bytes of a random RGB PNG of the given size
+    """
+
+    rows = [os.urandom(width * 3) for _ in range(height)]
+    f = io.BytesIO()
+    png.Writer(width, height, greyscale=False).write(f, rows)
+    return f.getvalue()
+
+def sneak(cover, payloads, **kwargs):
+    """
+    Return the bytes of the cover PNG with the payloads sneaked in
+    """
+
+    out = io.BytesIO()
+    encode(io.BytesIO(cover), out, payloads, **kwargs)
+    return out.getvalue()
+
+def unsneak(png_bytes, **kwargs):
+    """
+    Return the payload bytes sneaked into the PNG bytes
+    """
+
+    return bytes(decode(io.BytesIO(png_bytes), **kwargs))
+
+class SegmentTest(unittest.TestCase):
+    """
+    The segmented container and partial extraction
+    """
+
+    def setUp(self):
+        self.cover = make_cover(16, 2000)
+        self.payloads = [b"first payload", os.urandom(40), b"x" * 30]
+        self.whole = b"".join(self.payloads)
+
+    def test_single_payload(self):
+        for payload in [b"", b"hello world", os.urandom(50),
+                        b"a" * 200]:
+            png_bytes = sneak(self.cover, [payload])
+            self.assertEqual(unsneak(png_bytes), payload)
+
+    def test_whole_payload(self):
+        png_bytes = sneak(self.cover, self.payloads)
+        self.assertEqual(unsneak(png_bytes), self.whole)
+
+    def test_segment(self):
+        png_bytes = sneak(self.cover, self.payloads)
+        for n, payload in enumerate(self.payloads):
+            self.assertEqual(unsneak(png_bytes, segment=n), payload)
+        with self.assertRaises(SystemExit):
+            unsneak(png_bytes, segment=len(self.payloads))
+
+    def test_segment_size(self):
+        png_bytes = sneak(self.cover, self.payloads, segment_size=7)
+        self.assertEqual(unsneak(png_bytes), self.whole)
+        self.assertEqual(unsneak(png_bytes, segment=0), b"first p")
+        self.assertEqual(unsneak(png_bytes, segment=1), b"ayload")
+
+    def test_empty_payload_segment(self):
+        # An empty payload is a segment of its own,
+        # with or without a segment size
+        for segment_size, second in [(0, b"abcd"), (2, b"ab")]:
+            png_bytes = sneak(self.cover, [b"", b"abcd"],
+                              segment_size=segment_size)
+            self.assertEqual(unsneak(png_bytes, segment=0), b"")
+            self.assertEqual(unsneak(png_bytes, segment=1), second)
+
+    def test_range(self):
+        png_bytes = sneak(self.cover, self.payloads, segment_size=8)
+        size = len(self.whole)
+        for start, stop in [(0, size), (3, 20), (10, 11), (None, 5),
+                            (5, None), (-10, None), (None, -3),
+                            (-20, -5), (20, 3), (5, 5), (0, size + 10),
+                            (size + 5, None), (-size - 10, 4)]:
+            text = "%s:%s" % ("" if start is None else start,
+                              "" if stop is None else stop)
+            self.assertEqual(unsneak(png_bytes, byte_range=text),
+                             self.whole[start:stop], text)
+
+    def test_range_needs_segments(self):
+        png_bytes = sneak(self.cover, [b"not segmented"])
+        with self.assertRaises(SystemExit):
+            unsneak(png_bytes, byte_range="0:3")
+        with self.assertRaises(SystemExit):
+            unsneak(png_bytes, segment=0)
+
+    def test_index_too_big(self):
+        # An index claiming a segment far bigger than
+        # the image can hold has to be rejected
+        bad = BitStream(uint=1, length=SEG_COUNT_BITS)
+        bad += BitStream(uint=0, length=2)
+        bad += BitStream(uint=4, length=SEG_SIZE_BITS)
+        bad += BitStream(uint=2 ** SEG_SIZE_BITS - 2, length=SEG_SIZE_BITS)
+        with mock.patch.object(png_sneak_encode, "pack_segments",
+                               return_value=bad):
+            png_bytes = sneak(self.cover, self.payloads)
+        with self.assertRaises(SystemExit) as e:
+            unsneak(png_bytes)
+        self.assertIn("Bad segment index", str(e.exception))
+
+    def test_too_small(self):
+        with self.assertRaises(SystemExit):
+            sneak(make_cover(16, 20), [os.urandom(100)])
+
+class ChunkTest(unittest.TestCase):
+    """
+    Payload bits carried in the IDAT chunk lengths
+    """
+
+    def setUp(self):
+        # Too short to hold the payloads in its rows alone,
+        # but with plenty of IDAT data (random pixels don't compress)
+        self.cover = make_cover(200, 16)
+        self.payloads = [b"first payload", os.urandom(40), b"x" * 30]
+        self.whole = b"".join(self.payloads)
+
+    def test_chunk_bits(self):
+        payload = os.urandom(40)
+        for chunk_bits in [1, 2, 5, 8]:
+            png_bytes = sneak(self.cover, [payload],
+                              chunk_bits=chunk_bits)
+            self.assertEqual(unsneak(png_bytes), payload, chunk_bits)
+
+    def test_fits_in_rows(self):
+        # Nothing left over for the chunk lengths
+        png_bytes = sneak(self.cover, [b"hi"], chunk_bits=4)
+        self.assertEqual(unsneak(png_bytes), b"hi")
+
+    def test_pixels_untouched(self):
+        png_bytes = sneak(self.cover, [os.urandom(40)], chunk_bits=3)
+        cover_rows = png.Reader(bytes=self.cover).read()[2]
+        output_rows = png.Reader(bytes=png_bytes).read()[2]
+        self.assertEqual([bytes(row) for row in cover_rows],
+                         [bytes(row) for row in output_rows])
+
+    def test_with_segments(self):
+        for chunk_bits in [1, 2, 5]:
+            png_bytes = sneak(self.cover, self.payloads,
+                              segment_size=16, chunk_bits=chunk_bits)
+            self.assertEqual(unsneak(png_bytes), self.whole)
+            # Each payload is split up on its own
+            self.assertEqual(unsneak(png_bytes, segment=0),
+                             self.payloads[0])
+            self.assertEqual(unsneak(png_bytes, segment=2),
+                             self.payloads[1][16:32])
+            self.assertEqual(unsneak(png_bytes, segment=5),
+                             self.payloads[2][16:])
+            self.assertEqual(unsneak(png_bytes, byte_range="-10:"),
+                             self.whole[-10:])
+            self.assertEqual(unsneak(png_bytes, byte_range="30:12"), b"")
+
+    def test_without_chunk_bits_too_small(self):
+        with self.assertRaises(SystemExit):
+            sneak(self.cover, [os.urandom(40)])
+
+    def test_too_few_idat_bytes(self):
+        with self.assertRaises(SystemExit):
+            sneak(self.cover, [os.urandom(400)], chunk_bits=16)
+
+    def test_bad_chunk_bits(self):
+        for chunk_bits in [-1, 17]:
+            with self.assertRaises(SystemExit):
+                sneak(self.cover, [b"hi"], chunk_bits=chunk_bits)
+
+if __name__ == "__main__":
+    unittest.main()